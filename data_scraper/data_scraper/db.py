@@ -0,0 +1,12 @@
+def postgres_settings(settings):
+    """psycopg2.connect() arguments built from the POSTGRES_* settings"""
+    return {
+        'host': settings.get('POSTGRES_HOST'),
+        'port': settings.get('POSTGRES_PORT'),
+        'database': settings.get('POSTGRES_DB'),
+        'user': settings.get('POSTGRES_USER'),
+        'password': settings.get('POSTGRES_PASSWORD'),
+        'sslmode': settings.get('POSTGRES_SSL_MODE'),
+        # Connections are opened from the reactor thread, never wait forever on them
+        'connect_timeout': settings.getint('POSTGRES_CONNECT_TIMEOUT', 10)
+    }
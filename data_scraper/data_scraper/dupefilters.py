@@ -0,0 +1,249 @@
+import json
+import logging
+import mmap
+from math import ceil, log
+from pathlib import Path
+from time import time
+
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.utils.request import referer_str
+
+
+class BloomFilter:
+    """Fixed-capacity Bloom filter whose bit array lives in a memory-mapped file."""
+
+    def __init__(self, path, capacity, error_rate, count=0):
+        self.path = Path(path)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = count
+        self.num_bits = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * log(2)))
+
+        size = (self.num_bits + 7) // 8
+        with self.path.open('a+b') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self.file = self.path.open('r+b')
+        self.bits = mmap.mmap(self.file.fileno(), size)
+
+    def _positions(self, fingerprint):
+        # Double hashing on the request fingerprint, which is already a SHA1 digest
+        h1 = int.from_bytes(fingerprint[:8], 'little')
+        h2 = int.from_bytes(fingerprint[8:16], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def __contains__(self, fingerprint):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fingerprint))
+
+    def add(self, fingerprint):
+        for pos in self._positions(fingerprint):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
+
+    @property
+    def size(self):
+        return len(self.bits)
+
+    def set_bits(self, chunk_size=1 << 20):
+        total = 0
+        for start in range(0, len(self.bits), chunk_size):
+            total += int.from_bytes(self.bits[start:start + chunk_size], 'little').bit_count()
+        return total
+
+    def close(self):
+        self.bits.flush()
+        self.bits.close()
+        self.file.close()
+
+
+class ScalableBloomFilter:
+    """Chain of Bloom filters growing geometrically, keeping the overall false positive
+    rate under error_rate whatever the number of fingerprints added.
+
+    The filter files and a bloom.json state file are kept in directory so that
+    an interrupted run can be resumed with the requests it had already seen. The
+    state is written whenever a slice is added and every save_interval seconds,
+    so a run that is killed can be resumed too.
+    """
+
+    state_file = 'bloom.json'
+
+    def __init__(self, directory, initial_capacity, error_rate, growth=2, tightening=0.5, expiration_secs=0,
+                 save_interval=30):
+        self.directory = Path(directory)
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.created_at = time()
+        self.save_interval = save_interval
+        self.saved_at = time()
+        self.filters = []
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        state = self._read_state()
+        if state and expiration_secs and time() - state['created_at'] > expiration_secs:
+            self.clear()
+            state = None
+        if not state:
+            # Slice files without a valid state belong to another crawl
+            self.clear()
+        else:
+            self.created_at = state['created_at']
+            for f in state['filters']:
+                self.filters.append(
+                    BloomFilter(self.directory / f['file'], f['capacity'], f['error_rate'], f['count'])
+                )
+
+    def _read_state(self):
+        path = self.directory / self.state_file
+        if not path.exists():
+            return None
+        state = json.loads(path.read_text())
+        if state['error_rate'] != self.error_rate or state['initial_capacity'] != self.initial_capacity:
+            # Filter sizes depend on these settings, start over when they change
+            self.clear()
+            return None
+        return state
+
+    def clear(self):
+        for path in self.directory.glob('bloom-*.bin'):
+            path.unlink()
+        (self.directory / self.state_file).unlink(missing_ok=True)
+
+    def _add_filter(self):
+        index = len(self.filters)
+        # Slice error rates form a geometric series summing to at most error_rate
+        self.filters.append(BloomFilter(
+            self.directory / f'bloom-{index}.bin',
+            self.initial_capacity * self.growth ** index,
+            self.error_rate * (1 - self.tightening) * self.tightening ** index,
+        ))
+
+    def __contains__(self, fingerprint):
+        return any(fingerprint in f for f in reversed(self.filters))
+
+    def add(self, fingerprint):
+        if not self.filters or self.filters[-1].is_full:
+            self._add_filter()
+            self.save()
+        self.filters[-1].add(fingerprint)
+        if self.save_interval and time() - self.saved_at >= self.save_interval:
+            self.save()
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    @property
+    def memory_bytes(self):
+        return sum(f.size for f in self.filters)
+
+    @property
+    def fill_ratio(self):
+        total_bits = sum(f.num_bits for f in self.filters)
+        return sum(f.set_bits() for f in self.filters) / total_bits if total_bits else 0.0
+
+    def save(self):
+        state = {
+            'created_at': self.created_at,
+            'initial_capacity': self.initial_capacity,
+            'error_rate': self.error_rate,
+            'filters': [
+                {'file': f.path.name, 'capacity': f.capacity, 'error_rate': f.error_rate, 'count': f.count}
+                for f in self.filters
+            ],
+        }
+        for f in self.filters:
+            f.bits.flush()
+        # Written then renamed, a run killed mid-write keeps the previous state
+        path = self.directory / self.state_file
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(state))
+        tmp_path.replace(path)
+        self.saved_at = time()
+
+    def close(self):
+        self.save()
+        for f in self.filters:
+            f.close()
+
+
+class BloomDupeFilter(BaseDupeFilter):
+    """Request dupefilter backed by a persistent scalable Bloom filter.
+
+    Memory grows with log(seen requests) instead of linearly like the default
+    fingerprint set. Seen requests are kept in BLOOMFILTER_DIR until the crawl
+    finishes, so a run that was interrupted resumes without refetching them,
+    while the next complete run starts from an empty filter.
+    """
+
+    def __init__(self, bloom, fingerprinter, stats, debug=False, targeted=False):
+        self.bloom = bloom
+        self.fingerprinter = fingerprinter
+        self.stats = stats
+        self.debug = debug
+        # Targeted runs bypass the filter and must leave the state of an interrupted full crawl alone
+        self.targeted = targeted
+        self.logdupes = True
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        directory = Path(settings.get('BLOOMFILTER_DIR', 'httpcache/dupefilter'), crawler.spider.name)
+        bloom = ScalableBloomFilter(
+            directory,
+            settings.getint('BLOOMFILTER_INITIAL_CAPACITY', 100_000),
+            settings.getfloat('BLOOMFILTER_ERROR_RATE', 0.001),
+            expiration_secs=settings.getint('BLOOMFILTER_EXPIRATION_SECS', 0),
+            save_interval=settings.getint('BLOOMFILTER_SAVE_INTERVAL', 30),
+        )
+        return cls(
+            bloom,
+            crawler.request_fingerprinter,
+            crawler.stats,
+            settings.getbool('DUPEFILTER_DEBUG'),
+            getattr(crawler.spider, 'scope', None) is not None,
+        )
+
+    def open(self):
+        self.stats.set_value('dupefilter/bloom/restored', len(self.bloom))
+
+    def request_seen(self, request):
+        fp = self.fingerprinter.fingerprint(request)
+        if fp in self.bloom:
+            return True
+        self.bloom.add(fp)
+        return False
+
+    def close(self, reason):
+        self.stats.set_value('dupefilter/bloom/count', len(self.bloom))
+        self.stats.set_value('dupefilter/bloom/slices', len(self.bloom.filters))
+        self.stats.set_value('dupefilter/bloom/memory_bytes', self.bloom.memory_bytes)
+        self.stats.set_value('dupefilter/bloom/fill_ratio', round(self.bloom.fill_ratio, 4))
+        self.bloom.close()
+        if reason == 'finished' and not self.targeted:
+            # The next run is a new crawl, not the continuation of this one
+            self.bloom.clear()
+
+    def log(self, request, spider):
+        if self.debug:
+            msg = "Filtered duplicate request: %(request)s (referer: %(referer)s)"
+            args = {"request": request, "referer": referer_str(request)}
+            self.logger.debug(msg, args, extra={"spider": spider})
+        elif self.logdupes:
+            msg = (
+                "Filtered duplicate request: %(request)s"
+                " - no more duplicates will be shown"
+                " (see DUPEFILTER_DEBUG to show all duplicates)"
+            )
+            self.logger.debug(msg, {"request": request}, extra={"spider": spider})
+            self.logdupes = False
+
+        self.stats.inc_value("dupefilter/filtered")
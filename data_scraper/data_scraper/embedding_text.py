@@ -0,0 +1,84 @@
+"""Preparation of book descriptions before they are sent to the embedding model.
+
+Descriptions are normalized (HTML entities, unicode forms, whitespace, the
+"...more" left by the site), then counted with the model tokenizer and fitted
+to its input limit: truncated, or split into chunks whose embeddings are
+averaged by the caller.
+"""
+import html
+import math
+import re
+import unicodedata
+
+
+# Rough token estimate for the stats when tiktoken or its encoding data is unavailable
+APPROX_CHARS_PER_TOKEN = 3
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_MORE = re.compile(r'\s*\.{3}\s*more$', re.IGNORECASE)
+
+_encodings = {}
+
+
+def normalize_description(text):
+    text = unicodedata.normalize('NFKC', html.unescape(text))
+    text = _WHITESPACE.sub(' ', text).strip()
+    return _TRAILING_MORE.sub('', text)
+
+
+def get_encoding(name):
+    """tiktoken encoding, None when it cannot be loaded (tiktoken missing, no network for its data)"""
+    if name not in _encodings:
+        try:
+            import tiktoken
+
+            _encodings[name] = tiktoken.get_encoding(name)
+        except Exception:
+            _encodings[name] = None
+    return _encodings[name]
+
+
+def _split_utf8(text, max_bytes, max_pieces):
+    # Byte-level BPE never yields more tokens than UTF-8 bytes: pieces of max_bytes
+    # bytes always fit the limit, whatever the script of the text
+    pieces, piece, size = [], [], 0
+    for char in text:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > max_bytes:
+            pieces.append(''.join(piece))
+            if len(pieces) == max_pieces:
+                return pieces
+            piece, size = [], 0
+        piece.append(char)
+        size += char_size
+    if piece:
+        pieces.append(''.join(piece))
+    return pieces
+
+
+def split_tokens(text, max_tokens, max_chunks=1, encoding_name='cl100k_base'):
+    """Returns ([(chunk, tokens)], total tokens of text).
+
+    Chunks are consecutive pieces of at most max_tokens tokens, at most max_chunks
+    of them: with max_chunks=1 the text is truncated to its first max_tokens tokens.
+    """
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        pieces = _split_utf8(text, max_tokens, max_chunks)
+        estimate = lambda value: math.ceil(len(value) / APPROX_CHARS_PER_TOKEN)
+        return [(piece, estimate(piece)) for piece in pieces], estimate(text)
+
+    tokens = encoding.encode(text, disallowed_special=())
+    chunks = [
+        (encoding.decode(tokens[start:start + max_tokens]), len(tokens[start:start + max_tokens]))
+        for start in range(0, len(tokens), max_tokens)
+    ][:max_chunks]
+    return chunks, len(tokens)
+
+
+def average_embeddings(embeddings, weights):
+    """Weighted mean of the chunk embeddings, scaled back to unit length like the model output"""
+    total = sum(weights)
+    mean = [sum(weight * value for weight, value in zip(weights, values)) / total for values in zip(*embeddings)]
+    norm = math.sqrt(sum(value * value for value in mean)) or 1.0
+    return [value / norm for value in mean]
@@ -0,0 +1,120 @@
+from time import monotonic
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from data_scraper.signals import item_pipeline_processed
+
+
+class PipelineBackpressure:
+    """Slows down or pauses request scheduling while the item pipelines lag behind.
+
+    Queue depth is the number of responses waiting to be parsed plus the items
+    currently in the pipelines. Latency is a moving average of the time the
+    project pipelines spend on one item, reported through item_pipeline_processed.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = settings.getfloat('BACKPRESSURE_INTERVAL', 1.0)
+        self.throttle_depth = settings.getint('BACKPRESSURE_THROTTLE_DEPTH', 50)
+        self.pause_depth = settings.getint('BACKPRESSURE_PAUSE_DEPTH', 200)
+        self.resume_depth = settings.getint('BACKPRESSURE_RESUME_DEPTH', 20)
+        self.max_latency = settings.getfloat('BACKPRESSURE_MAX_LATENCY', 1.0)
+        self.throttle_delay = settings.getfloat('BACKPRESSURE_THROTTLE_DELAY', 1.0)
+        self.latency_smoothing = settings.getfloat('BACKPRESSURE_LATENCY_SMOOTHING', 0.2)
+
+        self.latency = 0.0
+        self.throttled = False
+        self.paused_at = None
+        self.original_delays = {}
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('BACKPRESSURE_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.item_processed, signal=item_pipeline_processed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.task = task.LoopingCall(self._check, spider)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        if self.paused_at is not None:
+            self._resume(spider)
+        self.stats.set_value('backpressure/pipeline_latency_avg', round(self.latency, 4))
+
+    def item_processed(self, pipeline, latency, spider):
+        self.latency += self.latency_smoothing * (latency - self.latency)
+        self.stats.max_value('backpressure/pipeline_latency_max', round(latency, 4))
+        self.stats.max_value(f'backpressure/{pipeline}/latency_max', round(latency, 4))
+
+    def queue_depth(self):
+        slot = self.crawler.engine.scraper.slot
+        if slot is None:
+            return 0
+        return len(slot.queue) + slot.itemproc_size
+
+    def _check(self, spider):
+        depth = self.queue_depth()
+        self.stats.max_value('backpressure/queue_depth_max', depth)
+
+        if self.paused_at is None and depth >= self.pause_depth:
+            self._pause(spider, depth)
+        elif self.paused_at is not None and depth <= self.resume_depth:
+            self._resume(spider)
+
+        overloaded = depth >= self.throttle_depth or self.latency >= self.max_latency
+        if overloaded and not self.throttled:
+            self._throttle(spider, depth)
+        elif not overloaded and self.throttled:
+            self._unthrottle(spider)
+        elif self.throttled:
+            # Slots created since throttling started use the default delay
+            self._apply_throttle_delay()
+
+    def _pause(self, spider, depth):
+        self.crawler.engine.pause()
+        self.paused_at = monotonic()
+        self.stats.inc_value('backpressure/paused_count')
+        spider.logger.warning(f"⏸️ Pipeline backlog of {depth} items, pausing request scheduling")
+
+    def _resume(self, spider):
+        self.stats.inc_value('backpressure/paused_seconds', round(monotonic() - self.paused_at, 2))
+        self.paused_at = None
+        self.crawler.engine.unpause()
+        spider.logger.info("▶️ Pipeline backlog drained, resuming request scheduling")
+
+    def _throttle(self, spider, depth):
+        self.throttled = True
+        self._apply_throttle_delay()
+        self.stats.inc_value('backpressure/throttled_count')
+        spider.logger.info(
+            f"🐢 Pipelines lagging (queue {depth}, latency {self.latency:.2f}s), "
+            f"download delay raised to {self.throttle_delay}s"
+        )
+
+    def _apply_throttle_delay(self):
+        for key, slot in self.crawler.engine.downloader.slots.items():
+            if key not in self.original_delays:
+                self.original_delays[key] = slot.delay
+                slot.delay = max(slot.delay, self.throttle_delay)
+
+    def _unthrottle(self, spider):
+        slots = self.crawler.engine.downloader.slots
+        for key, delay in self.original_delays.items():
+            if key in slots:
+                slots[key].delay = delay
+        self.original_delays = {}
+        self.throttled = False
+        spider.logger.info("🐇 Pipelines caught up, download delay restored")
@@ -0,0 +1,59 @@
+from time import perf_counter
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from data_scraper.db import postgres_settings
+
+
+class BookNeighbors:
+    """Refreshes the book_neighbors table once a crawl has finished"""
+
+    def __init__(self, db_settings, k, block_size, stats):
+        self.db_settings = db_settings
+        self.k = k
+        self.block_size = block_size
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('BOOK_NEIGHBORS_ENABLED'):
+            raise NotConfigured
+        db_settings = postgres_settings(crawler.settings)
+        ext = cls(
+            db_settings,
+            crawler.settings.getint('BOOK_NEIGHBORS_K', 10),
+            crawler.settings.getint('BOOK_NEIGHBORS_BLOCK_SIZE', 1024),
+            crawler.stats
+        )
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_closed(self, spider, reason):
+        if reason != 'finished':
+            spider.logger.info(f"⏭️ Crawl {reason}, book neighbours not refreshed")
+            return
+
+        import psycopg2
+
+        from data_scraper.neighbors import update_book_neighbors
+
+        started = perf_counter()
+        connection = None
+        try:
+            connection = psycopg2.connect(**self.db_settings)
+            counts = update_book_neighbors(connection, self.k, self.block_size)
+        except Exception as e:
+            spider.logger.error(f"❌ Book neighbours computation error : {e}")
+            return
+        finally:
+            if connection:
+                connection.close()
+
+        for name, value in counts.items():
+            self.stats.set_value(f'book_neighbors/{name}', value)
+        self.stats.set_value('book_neighbors/seconds', round(perf_counter() - started, 3))
+        spider.logger.info(
+            f"✅ Book neighbours refreshed: {counts['recomputed']} of {counts['books']} books "
+            f"({counts['changed']} new or changed embeddings)"
+        )
@@ -0,0 +1,71 @@
+import os
+import sys
+from time import monotonic
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+
+def process_uptime():
+    """Seconds since the process started, read from /proc (Linux containers), None elsewhere"""
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name field may contain spaces, fields are counted after it
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            system_uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return system_uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+
+
+class StartupTiming:
+    """Records how long the crawl takes to get going, in startup/* stats.
+
+    Timings are relative to the process start when available, so container cold
+    starts are measured end to end, and STARTUP_TRACKED_MODULES lists the heavy
+    modules that were already imported when the spider opened.
+    """
+
+    def __init__(self, stats, tracked_modules):
+        self.stats = stats
+        self.tracked_modules = tracked_modules
+        uptime = process_uptime()
+        self.started_at = monotonic() - (uptime or 0)
+        self.seen = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('STARTUP_TIMING_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler.stats, crawler.settings.getlist('STARTUP_TRACKED_MODULES'))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def _record_once(self, name):
+        if name not in self.seen:
+            self.seen.add(name)
+            self.stats.set_value(f'startup/{name}_secs', round(monotonic() - self.started_at, 3))
+
+    def spider_opened(self, spider):
+        self._record_once('spider_opened')
+        self.stats.set_value('startup/modules_at_open', self._loaded_modules())
+
+    def request_reached_downloader(self, request, spider):
+        self._record_once('first_request')
+
+    def response_received(self, response, request, spider):
+        self._record_once('first_response')
+
+    def item_scraped(self, item, response, spider):
+        self._record_once('first_item')
+
+    def spider_closed(self, spider, reason):
+        self.stats.set_value('startup/modules_at_close', self._loaded_modules())
+
+    def _loaded_modules(self):
+        return [name for name in self.tracked_modules if name in sys.modules]
@@ -15,4 +15,8 @@ class Book(scrapy.Item):
     upc = scrapy.Field(serializer=str)
     tax = scrapy.Field(serializer=int)
     reviews = scrapy.Field(serializer=int)
-    scraped_at = scrapy.Field(serializer=str)
\ No newline at end of file
+    scraped_at = scrapy.Field(serializer=str)
+    # Served from the HTTP cache, not an actual fetch of the page
+    from_cache = scrapy.Field(serializer=bool)
+    # Asked by UPC or URL in a targeted crawl
+    requested = scrapy.Field(serializer=bool)
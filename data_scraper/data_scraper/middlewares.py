@@ -3,98 +3,292 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+import cProfile
+import heapq
+import io
+import json
+import pstats
+import random
+from datetime import datetime, timezone
+from pathlib import Path
+from time import monotonic, perf_counter, process_time
 
-# useful for handling different item types with a single interface
-from itemadapter import ItemAdapter
+from scrapy import Request, signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+
+from data_scraper.scheduler import frontier_worker_id
+
+
+DOWNLOADED_AT_META_KEY = "profiling_downloaded_at"
+RECRAWL_META_KEY = "recrawl_probability"
+
+
+def callback_name(spider, request):
+    # CrawlSpider sends every rule request to its own _callback, the rule holds the real one
+    rule = request.meta.get("rule")
+    if rule is not None and hasattr(spider, "_rules"):
+        callback = spider._rules[rule].callback
+    else:
+        callback = request.callback
+    return getattr(callback, "__name__", None) or "parse"
+
+
+class CallbackProfile:
+    """Aggregated timings of one spider callback"""
+
+    def __init__(self):
+        self.responses = 0
+        self.wall = 0.0
+        self.wall_max = 0.0
+        self.cpu = 0.0
+        self.latency = 0.0
+        self.latency_max = 0.0
+        self.items = 0
+        self.requests = 0
+
+    def add(self, wall, cpu, latency, items, requests):
+        self.responses += 1
+        self.wall += wall
+        self.wall_max = max(self.wall_max, wall)
+        self.cpu += cpu
+        if latency is not None:
+            self.latency += latency
+            self.latency_max = max(self.latency_max, latency)
+        self.items += items
+        self.requests += requests
+
+    def to_dict(self):
+        n = self.responses or 1
+        return {
+            "responses": self.responses,
+            "wall_total": round(self.wall, 6),
+            "wall_avg": round(self.wall / n, 6),
+            "wall_max": round(self.wall_max, 6),
+            "cpu_total": round(self.cpu, 6),
+            "cpu_avg": round(self.cpu / n, 6),
+            "download_to_parse_avg": round(self.latency / n, 6),
+            "download_to_parse_max": round(self.latency_max, 6),
+            "items_per_response": round(self.items / n, 3),
+            "requests_per_response": round(self.requests / n, 3),
+        }
 
 
 class DataScraperSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    """Opt-in profiling of the spider callbacks (PROFILING_ENABLED).
+
+    Measures wall and CPU time spent in each callback, the delay between the
+    download and the start of parsing, and how many items and requests each
+    response yields. A sample of responses (PROFILING_CPROFILE_SAMPLE_RATE) runs
+    under cProfile and the PROFILING_TOP_N slowest of them are kept. Everything
+    is written to PROFILING_OUTPUT_DIR when the spider closes.
+    """
+
+    def __init__(self, stats, output_dir, top_n, sample_rate, profile_lines, worker_id=None):
+        self.stats = stats
+        self.output_dir = Path(output_dir)
+        # Workers of a shared crawl close in the same second, their reports need distinct names
+        self.worker_id = worker_id
+        self.top_n = top_n
+        self.sample_rate = sample_rate
+        self.profile_lines = profile_lines
+        self.callbacks = {}
+        # Min-heaps of (wall, counter, entry) so the fastest entry is dropped first
+        self.slowest = []
+        self.profiled = []
+        self.counter = 0
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        settings = crawler.settings
+        if not settings.getbool("PROFILING_ENABLED"):
+            raise NotConfigured
+        s = cls(
+            crawler.stats,
+            settings.get("PROFILING_OUTPUT_DIR", "profiling"),
+            settings.getint("PROFILING_TOP_N", 10),
+            settings.getfloat("PROFILING_CPROFILE_SAMPLE_RATE", 0.0),
+            settings.getint("PROFILING_CPROFILE_LINES", 30),
+            frontier_worker_id(settings) if settings.getbool("FRONTIER_ENABLED") else None,
+        )
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
     def process_spider_input(self, response, spider):
         # Called for each response that goes through the spider
         # middleware and into the spider.
-
-        # Should return None or raise an exception.
+        downloaded_at = response.meta.get(DOWNLOADED_AT_META_KEY)
+        if downloaded_at is not None:
+            response.meta["profiling_latency"] = perf_counter() - downloaded_at
         return None
 
     def process_spider_output(self, response, result, spider):
-        # Called with the results returned from the Spider, after
-        # it has processed the response.
+        run = _CallbackRun(self, response, spider)
+        iterator = iter(result)
+        try:
+            while True:
+                with run:
+                    try:
+                        output = next(iterator)
+                    except StopIteration:
+                        return
+                run.count(output)
+                yield output
+        finally:
+            run.finish()
 
-        # Must return an iterable of Request, or item objects.
-        for i in result:
-            yield i
+    async def process_spider_output_async(self, response, result, spider):
+        run = _CallbackRun(self, response, spider)
+        iterator = result.__aiter__()
+        try:
+            while True:
+                with run:
+                    try:
+                        output = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                run.count(output)
+                yield output
+        finally:
+            run.finish()
 
-    def process_spider_exception(self, response, exception, spider):
-        # Called when a spider or process_spider_input() method
-        # (from other spider middleware) raises an exception.
+    def record(self, name, url, wall, cpu, latency, items, requests, profile):
+        self.callbacks.setdefault(name, CallbackProfile()).add(wall, cpu, latency, items, requests)
+        self.stats.inc_value(f"profiling/{name}/responses")
 
-        # Should return either None or an iterable of Request or item objects.
-        pass
+        self.counter += 1
+        entry = {
+            "url": url,
+            "callback": name,
+            "wall": round(wall, 6),
+            "cpu": round(cpu, 6),
+            "download_to_parse": round(latency, 6) if latency is not None else None,
+            "items": items,
+            "requests": requests,
+        }
+        self._keep_slowest(self.slowest, (wall, self.counter, entry))
+        if profile is not None:
+            self._keep_slowest(self.profiled, (wall, self.counter, (entry, profile)))
 
-    async def process_start(self, start):
-        # Called with an async iterator over the spider start() method or the
-        # maching method of an earlier spider middleware.
-        async for item_or_request in start:
-            yield item_or_request
+    def _keep_slowest(self, heap, value):
+        if len(heap) < self.top_n:
+            heapq.heappush(heap, value)
+        elif value[0] > heap[0][0]:
+            heapq.heapreplace(heap, value)
 
     def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+        spider.logger.info(f"⏱️ Callback profiling enabled, report in {self.output_dir}")
+
+    def spider_closed(self, spider, reason):
+        callbacks = {name: profile.to_dict() for name, profile in self.callbacks.items()}
+        for name, values in callbacks.items():
+            self.stats.set_value(f"profiling/{name}/wall_avg", values["wall_avg"])
+            self.stats.set_value(f"profiling/{name}/cpu_avg", values["cpu_avg"])
+
+        report = {
+            "spider": spider.name,
+            "reason": reason,
+            "callbacks": callbacks,
+            "slowest_responses": [entry for _, _, entry in sorted(self.slowest, key=lambda value: value[:2], reverse=True)],
+            "profiled_responses": [
+                {**entry, "profile": self._format_profile(profile)}
+                for _, _, (entry, profile) in sorted(self.profiled, key=lambda value: value[:2], reverse=True)
+            ],
+        }
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        suffix = f"-{self.worker_id}" if self.worker_id else ""
+        path = self.output_dir / f"profile-{spider.name}-{timestamp}{suffix}.json"
+        path.write_text(json.dumps(report, indent=2))
+        spider.logger.info(f"✅ Callback profiling report written to {path}")
+
+    def _format_profile(self, profile):
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(self.profile_lines)
+        return stream.getvalue()
+
+
+class _CallbackRun:
+    """Accumulates the time spent inside one callback, across its yields"""
+
+    def __init__(self, middleware, response, spider):
+        self.middleware = middleware
+        self.name = callback_name(spider, response.request)
+        self.url = response.url
+        self.latency = response.meta.get("profiling_latency")
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.items = 0
+        self.requests = 0
+        sample_rate = middleware.sample_rate
+        self.profile = cProfile.Profile() if sample_rate and random.random() < sample_rate else None
+
+    def __enter__(self):
+        self.started = perf_counter()
+        self.cpu_started = process_time()
+        if self.profile:
+            self.profile.enable()
+
+    def __exit__(self, *exc_info):
+        if self.profile:
+            self.profile.disable()
+        self.wall += perf_counter() - self.started
+        self.cpu += process_time() - self.cpu_started
+
+    def count(self, output):
+        if isinstance(output, Request):
+            self.requests += 1
+        else:
+            self.items += 1
+
+    def finish(self):
+        self.middleware.record(
+            self.name, self.url, self.wall, self.cpu, self.latency, self.items, self.requests, self.profile
+        )
 
 
 class DataScraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """Stamps responses with their download time for DataScraperSpiderMiddleware"""
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
-        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
-        return s
-
-    def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
-        return None
+        if not crawler.settings.getbool("PROFILING_ENABLED"):
+            raise NotConfigured
+        return cls()
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        request.meta[DOWNLOADED_AT_META_KEY] = perf_counter()
         return response
 
-    def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+class RecrawlBudgetMiddleware:
+    """Drops recrawls of known books once RECRAWL_TIME_BUDGET seconds have passed.
+
+    Recrawls are scheduled most likely changed first, so the ones dropped are the
+    least likely to have changed. Listing pages and new books are not affected.
+    """
+
+    def __init__(self, stats, time_budget):
+        self.stats = stats
+        self.time_budget = time_budget
+        self.deadline = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("RECRAWL_ENABLED") or not settings.getint("RECRAWL_TIME_BUDGET"):
+            raise NotConfigured
+        mw = cls(crawler.stats, settings.getint("RECRAWL_TIME_BUDGET"))
+        crawler.signals.connect(mw.spider_opened, signal=signals.spider_opened)
+        return mw
 
     def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+        self.deadline = monotonic() + self.time_budget
+
+    def process_request(self, request, spider):
+        if RECRAWL_META_KEY not in request.meta or self.deadline is None:
+            return None
+        if monotonic() > self.deadline:
+            self.stats.inc_value("recrawl/skipped_time_budget")
+            raise IgnoreRequest("Recrawl time budget exhausted")
+        return None
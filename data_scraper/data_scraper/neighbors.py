@@ -0,0 +1,167 @@
+"""Precomputed "similar books", so the API serves them with a primary-key lookup
+instead of one IVFFLAT query per request.
+
+Neighbours are the top-k books by cosine similarity of description embeddings.
+Only rows that can have changed since the last computation are recomputed:
+books whose embedding is new or updated, books whose stored neighbours include
+one of those, and books for which one of those now scores above their k-th
+neighbour.
+"""
+import numpy as np
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _merge_top_k(scores, indices, k):
+    """Keeps the k best (score, index) pairs of each row, sorted by decreasing score"""
+    if scores.shape[1] > k:
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, best, axis=1)
+        indices = np.take_along_axis(indices, best, axis=1)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+def top_k_neighbors(matrix, rows, k, block_size=1024):
+    """Yields (rows, neighbor indices, scores) for blocks of the requested rows.
+
+    matrix must have unit-length rows. Similarities are computed block_size rows
+    by block_size columns at a time, keeping a running top-k per row, so memory
+    stays bounded whatever the number of books.
+    """
+    k = min(k, len(matrix) - 1)
+    if k <= 0:
+        return
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        best_scores = np.full((len(block_rows), 0), -np.inf, dtype=np.float32)
+        best_indices = np.empty((len(block_rows), 0), dtype=np.int64)
+
+        for col_start in range(0, len(matrix), block_size):
+            columns = np.arange(col_start, min(col_start + block_size, len(matrix)))
+            scores = matrix[block_rows] @ matrix[columns].T
+            # A book is not its own neighbour
+            scores[block_rows[:, None] == columns[None, :]] = -np.inf
+            best_scores, best_indices = _merge_top_k(
+                np.hstack([best_scores, scores]),
+                np.hstack([best_indices, np.broadcast_to(columns, scores.shape)]),
+                k
+            )
+        yield block_rows, best_indices, best_scores
+
+
+def max_similarity(matrix, rows, columns, block_size=1024):
+    """Best similarity of each of rows against columns, computed block by block"""
+    result = np.full(len(rows), -np.inf, dtype=np.float32)
+    if len(columns) == 0:
+        return result
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        for col_start in range(0, len(columns), block_size):
+            block_columns = columns[col_start:col_start + block_size]
+            scores = matrix[block_rows] @ matrix[block_columns].T
+            scores[block_rows[:, None] == block_columns[None, :]] = -np.inf
+            result[start:start + len(block_rows)] = np.maximum(
+                result[start:start + len(block_rows)], scores.max(axis=1)
+            )
+    return result
+
+
+def create_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS book_neighbors (
+            book_id INTEGER NOT NULL,
+            rank SMALLINT NOT NULL,
+            neighbor_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            computed_at TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (book_id, rank)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS book_neighbors_neighbor_id_idx
+        ON book_neighbors (neighbor_id)
+    ''')
+
+
+def update_book_neighbors(connection, k=10, block_size=1024):
+    """Recomputes the book_neighbors rows affected by new or changed embeddings.
+
+    Returns a dict of counters for the crawl stats.
+    """
+    from psycopg2.extras import execute_values
+
+    cursor = connection.cursor()
+    try:
+        # Workers of a shared crawl all finish with this stage, one at a time:
+        # the ones after the first only recompute what changed meanwhile
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('book_neighbors'))")
+        create_table(cursor)
+        # Embeddings written after this point will be picked up by the next run
+        cursor.execute('SELECT NOW()')
+        computed_at = cursor.fetchone()[0]
+
+        cursor.execute('''
+            SELECT id, description_embedding::real[],
+                embedding_updated_at > (SELECT MAX(computed_at) FROM book_neighbors)
+                OR NOT EXISTS (SELECT 1 FROM book_neighbors n WHERE n.book_id = books.id)
+            FROM books
+            WHERE description_embedding IS NOT NULL
+            ORDER BY id
+        ''')
+        rows = cursor.fetchall()
+        if not rows:
+            return {'books': 0, 'changed': 0, 'recomputed': 0}
+
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        matrix = normalize_rows(np.array([row[1] for row in rows], dtype=np.float32))
+        changed = np.flatnonzero([bool(row[2]) for row in rows])
+        if len(changed) == 0:
+            return {'books': len(ids), 'changed': 0, 'recomputed': 0}
+
+        # Current k-th score and neighbours of every book, to find which lists can change
+        position = {book_id: i for i, book_id in enumerate(ids.tolist())}
+        cursor.execute('SELECT book_id, neighbor_id, score FROM book_neighbors')
+        kth_score = np.full(len(ids), np.inf, dtype=np.float32)
+        list_size = np.zeros(len(ids), dtype=np.int64)
+        affected = np.zeros(len(ids), dtype=bool)
+        affected[changed] = True
+        changed_ids = set(ids[changed].tolist())
+        for book_id, neighbor_id, score in cursor.fetchall():
+            i = position.get(book_id)
+            if i is None:
+                continue
+            kth_score[i] = min(kth_score[i], score)
+            list_size[i] += 1
+            if neighbor_id in changed_ids or neighbor_id not in position:
+                affected[i] = True
+
+        expected_size = min(k, len(ids) - 1)
+        affected |= list_size < expected_size
+        others = np.flatnonzero(~affected)
+        best_changed = max_similarity(matrix, others, changed, block_size)
+        affected[others[best_changed > kth_score[others]]] = True
+
+        recomputed = np.flatnonzero(affected)
+        values = []
+        for block_rows, indices, scores in top_k_neighbors(matrix, recomputed, k, block_size):
+            for row, row_indices, row_scores in zip(block_rows, indices, scores):
+                for rank, (neighbor, score) in enumerate(zip(row_indices, row_scores), start=1):
+                    values.append((int(ids[row]), rank, int(ids[neighbor]), float(score), computed_at))
+
+        cursor.execute('DELETE FROM book_neighbors WHERE book_id = ANY(%s)', (ids[recomputed].tolist(),))
+        execute_values(cursor, '''
+            INSERT INTO book_neighbors (book_id, rank, neighbor_id, score, computed_at)
+            VALUES %s
+        ''', values, page_size=1000)
+        connection.commit()
+        return {'books': len(ids), 'changed': len(changed), 'recomputed': len(recomputed)}
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
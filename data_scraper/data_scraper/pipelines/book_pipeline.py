@@ -1,65 +1,76 @@
 from random import randint, uniform
+from time import perf_counter
 import random
 
-import psycopg2
-from openai import AzureOpenAI
-
 from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem
+from scrapy.utils.defer import deferred_from_coro
 
+from data_scraper.db import postgres_settings
+from data_scraper.embedding_text import average_embeddings, get_encoding, normalize_description, split_tokens
 from data_scraper.items.book import Book
 from data_scraper.items.genre import Genre
+from data_scraper.recrawl import content_hash, create_table as create_crawl_stats_table, record_fetch
+from data_scraper.scope import in_scope
+from data_scraper.signals import book_persisted, item_pipeline_processed
 
 
 class BookPGPersistencePipeline:
     collection_name = "books"
 
-    def __init__(self, db_settings, openai_settings):
+    def __init__(self, db_settings, openai_settings, crawler=None, embedding_settings=None):
         self.db_settings = db_settings
         self.openai_settings = openai_settings
+        self.crawler = crawler
+        self.embedding_settings = embedding_settings or {
+            'encoding': 'cl100k_base',
+            'max_tokens': 8191,
+            'max_chunks': 1
+        }
+        self.tokenizer_checked = False
+        # Stored embeddings are only read back for the Parquet export
+        self.read_stored_embeddings = False
         self.connection = None
         self.openai_client = None
+        self.tables_created = False
+        # Set when the first connection fails, later items are dropped without retrying
+        self.connection_failed = False
 
     @classmethod
     def from_crawler(cls, crawler):
-        db_settings = {
-            'host': crawler.settings.get('POSTGRES_HOST'),
-            'port': crawler.settings.get('POSTGRES_PORT'),
-            'database': crawler.settings.get('POSTGRES_DB'),
-            'user': crawler.settings.get('POSTGRES_USER'),
-            'password': crawler.settings.get('POSTGRES_PASSWORD'),
-            'sslmode': crawler.settings.get('POSTGRES_SSL_MODE')
-        }
+        db_settings = postgres_settings(crawler.settings)
         openai_settings = {
             'api_key': crawler.settings.get('AZURE_OPENAI_API_KEY'),
             'endpoint': crawler.settings.get('AZURE_OPENAI_ENDPOINT'),
             'api_version': crawler.settings.get('AZURE_OPENAI_API_VERSION'),
             'deployment': crawler.settings.get('AZURE_OPENAI_EMBEDDING_DEPLOYMENT')
         }
-        return cls(db_settings, openai_settings)
+        embedding_settings = {
+            'encoding': crawler.settings.get('EMBEDDING_ENCODING', 'cl100k_base'),
+            'max_tokens': crawler.settings.getint('EMBEDDING_MAX_TOKENS', 8191),
+            'max_chunks': max(1, crawler.settings.getint('EMBEDDING_MAX_CHUNKS', 1))
+        }
+        pipeline = cls(db_settings, openai_settings, crawler, embedding_settings)
+        pipeline.read_stored_embeddings = crawler.settings.getbool('PARQUET_EXPORT_ENABLED')
+        return pipeline
 
     def open_spider(self, spider):
-        # Open connection to DB
-        try:
-            self.connection = psycopg2.connect(**self.db_settings)
-            spider.logger.info("✅ Azure PostgreSQL connected")
-
-            # Initialize Azure OpenAI client
-            if all(self.openai_settings.values()):
-                self.openai_client = AzureOpenAI(
-                    api_key=self.openai_settings['api_key'],
-                    api_version=self.openai_settings['api_version'],
-                    azure_endpoint=self.openai_settings['endpoint']
-                )
-                spider.logger.info("✅ Azure OpenAI client initialized")
-            else:
-                spider.logger.warning("⚠️ Azure OpenAI settings incomplete, embeddings will be skipped")
-
-            # Create table if needed
-            self._create_tables()
-
-        except Exception as e:
-            spider.logger.error(f"❌ Azure PostgreSQL connection error : {e}")
-            raise
+        # DB connection and OpenAI client are opened with the first item,
+        # runs that never reach this pipeline don't pay for them
+        if not all(self.openai_settings.values()):
+            spider.logger.warning("⚠️ Azure OpenAI settings incomplete, embeddings will be skipped")
+
+    def _get_openai_client(self, spider):
+        if self.openai_client is None and all(self.openai_settings.values()):
+            from openai import AzureOpenAI
+
+            self.openai_client = AzureOpenAI(
+                api_key=self.openai_settings['api_key'],
+                api_version=self.openai_settings['api_version'],
+                azure_endpoint=self.openai_settings['endpoint']
+            )
+            spider.logger.info("✅ Azure OpenAI client initialized")
+        return self.openai_client
 
     def _create_tables(self):
         cursor = self.connection.cursor()
@@ -82,6 +93,9 @@ class BookPGPersistencePipeline:
             )
         ''')
 
+        # Lets the book_neighbors stage recompute only what changed
+        cursor.execute('ALTER TABLE books ADD COLUMN IF NOT EXISTS embedding_updated_at TIMESTAMPTZ')
+
         # Create vector index for similarity search
         cursor.execute('''
             CREATE INDEX IF NOT EXISTS books_description_embedding_idx
@@ -108,17 +122,39 @@ class BookPGPersistencePipeline:
                 scraped_at TIMESTAMPTZ
             )
         ''')
+
+        # Fetch history used to schedule recrawls by change frequency
+        create_crawl_stats_table(cursor)
         self.connection.commit()
         cursor.close()
 
     def _ensure_connection(self, spider):
         """Vérifie et rétablit la connexion si nécessaire"""
+        if self.connection is not None and not self.connection.closed:
+            return
+        if self.connection_failed:
+            raise DropItem("Azure PostgreSQL unavailable")
+
+        import psycopg2
+
         try:
-            if self.connection is None or self.connection.closed:
-                self.connection = psycopg2.connect(**self.db_settings)
-                spider.logger.info("🔄 Reconnected to Azure PostgreSQL")
+            reconnecting = self.connection is not None
+            self.connection = psycopg2.connect(**self.db_settings)
+            if self.crawler:
+                self.crawler.stats.inc_value(f'pipeline/{self.collection_name}/db_connections')
+            spider.logger.info("🔄 Reconnected to Azure PostgreSQL" if reconnecting else "✅ Azure PostgreSQL connected")
+
+            # Create table if needed
+            if not self.tables_created:
+                self._create_tables()
+                self.tables_created = True
         except Exception as e:
-            spider.logger.error(f"❌ Reconnection error: {e}")
+            spider.logger.error(f"❌ Azure PostgreSQL connection error : {e}")
+            if not self.tables_created:
+                # Nothing can be persisted this run, stop instead of failing every item
+                self.connection_failed = True
+                if self.crawler:
+                    deferred_from_coro(self.crawler.engine.close_spider_async(reason='postgres_unavailable'))
             raise
 
     def close_spider(self, spider):
@@ -128,33 +164,85 @@ class BookPGPersistencePipeline:
             spider.logger.info("✅ Disconnected from Azure PostgreSQL")
 
     def process_item(self, item, spider):
+        started = perf_counter()
         if isinstance(item, Book):
             adapter = ItemAdapter(item).asdict()
+            if not in_scope(spider, adapter):
+                # Targeted crawl: not one of the requested genres, UPCs or URLs
+                if self.crawler:
+                    self.crawler.stats.inc_value(f'pipeline/{self.collection_name}/out_of_scope')
+                return item
             self._save_book(adapter, spider)
-            return item
         elif isinstance(item, Genre):
             adapter = ItemAdapter(item).asdict()
             self._save_genre(adapter, spider)
-            return item
         else:
             return item
 
+        # Report latency for the backpressure extension
+        if self.crawler:
+            self.crawler.signals.send_catch_log(
+                signal=item_pipeline_processed,
+                pipeline=self.collection_name,
+                latency=perf_counter() - started,
+                spider=spider
+            )
+        return item
+
     def _generate_embedding(self, text, spider):
-        """Generates embeddings for given text"""
-        if not self.openai_client or not text:
+        """Generates embeddings for given text, fitted to the model input limit"""
+        if not text or not self._get_openai_client(spider):
+            return None
+
+        text_clean = normalize_description(text)
+        if not text_clean:
             return None
+        chunks = self._split_tokens(text_clean, spider)
 
         try:
-            text_clean = text.strip().replace('\n', ' ')
+            # All chunks of a description go in a single request
             response = self.openai_client.embeddings.create(
-                input=text_clean,
+                input=[chunk for chunk, _ in chunks],
                 model=self.openai_settings['deployment']
             )
-            return response.data[0].embedding
+            embeddings = [data.embedding for data in sorted(response.data, key=lambda data: data.index)]
+            if len(embeddings) == 1:
+                return embeddings[0]
+            return average_embeddings(embeddings, [chunk_tokens for _, chunk_tokens in chunks])
         except Exception as e:
             spider.logger.error(f"❌ Embedding generation error: {e}")
             return None
 
+    def _split_tokens(self, text, spider):
+        encoding = self.embedding_settings['encoding']
+        if not self.tokenizer_checked:
+            self.tokenizer_checked = True
+            if get_encoding(encoding) is None:
+                spider.logger.warning(f"⚠️ Tokenizer {encoding} unavailable, token counts are estimated")
+
+        chunks, tokens = split_tokens(
+            text,
+            self.embedding_settings['max_tokens'],
+            self.embedding_settings['max_chunks'],
+            encoding
+        )
+        if self.crawler:
+            stats = self.crawler.stats
+            sent = sum(chunk_tokens for _, chunk_tokens in chunks)
+            stats.inc_value('embedding/texts')
+            stats.inc_value('embedding/tokens', tokens)
+            stats.inc_value('embedding/tokens_sent', sent)
+            stats.max_value('embedding/tokens_max', tokens)
+            stats.set_value(
+                'embedding/tokens_avg',
+                round(stats.get_value('embedding/tokens') / stats.get_value('embedding/texts'), 1)
+            )
+            if len(chunks) > 1:
+                stats.inc_value('embedding/chunked')
+            if sent < tokens:
+                stats.inc_value('embedding/truncated')
+        return chunks
+
     def _save_book(self, adapter, spider):
         # Vérifier la connexion avant toute opération
         self._ensure_connection(spider)
@@ -163,8 +251,13 @@ class BookPGPersistencePipeline:
         # Save item in DB and replace values if it already exists
         try:
             # Check if the item already exists
-            cursor.execute('SELECT id, description FROM books WHERE upc = %s', (adapter.get('upc'),))
+            embedding_column = ', description_embedding::real[]' if self.read_stored_embeddings else ''
+            cursor.execute(
+                f'SELECT id, description{embedding_column} FROM books WHERE upc = %s',
+                (adapter.get('upc'),)
+            )
             existing = cursor.fetchone()
+            stored_embedding = existing[2] if existing is not None and self.read_stored_embeddings else None
 
             description = adapter.get('description')
             embedding = None
@@ -183,8 +276,9 @@ class BookPGPersistencePipeline:
                 cursor.execute('''
                     INSERT INTO books (
                         type, title, thumbnail, link, description,
-                        genre, upc, availability, description_embedding
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        genre, upc, availability, description_embedding,
+                        embedding_updated_at
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
                     ON CONFLICT (upc) DO UPDATE SET
                         type = EXCLUDED.type,
                         title = EXCLUDED.title,
@@ -193,7 +287,8 @@ class BookPGPersistencePipeline:
                         description = EXCLUDED.description,
                         genre = EXCLUDED.genre,
                         availability = EXCLUDED.availability,
-                        description_embedding = EXCLUDED.description_embedding
+                        description_embedding = EXCLUDED.description_embedding,
+                        embedding_updated_at = EXCLUDED.embedding_updated_at
                     RETURNING id
                 ''',
                    (adapter.get('type'),
@@ -207,19 +302,17 @@ class BookPGPersistencePipeline:
                     embedding))
                 book_id = cursor.fetchone()[0]
 
-                cursor.execute('''
-                        INSERT INTO updates (
-                            book_id, rating, price, stock,
-                            tax, reviews, scraped_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    ''',
-                   (book_id,
-                    max(0, min(5, int(adapter.get('rating')) + randint(-1,1))),
-                    float(adapter.get('price')) + uniform(-5, 5),
-                    int(adapter.get('stock')) + uniform(0, 5),
-                    float(adapter.get('tax')) + uniform(0, 2),
-                    int(adapter.get('reviews')) + randint(0,5),
-                    adapter.get('scraped_at')))
+                # Rounded here rather than by the INTEGER columns so exports match the DB
+                update = {
+                    'rating': max(0, min(5, int(adapter.get('rating')) + randint(-1,1))),
+                    'price': round(float(adapter.get('price')) + uniform(-5, 5)),
+                    'stock': round(int(adapter.get('stock')) + uniform(0, 5)),
+                    'tax': round(float(adapter.get('tax')) + uniform(0, 2)),
+                    'reviews': int(adapter.get('reviews')) + randint(0,5),
+                    'scraped_at': adapter.get('scraped_at'),
+                }
+                self._save_update(cursor, book_id, update)
+                self._record_fetch(cursor, adapter)
                 self.connection.commit()
             else:
                 cursor.execute('''
@@ -247,29 +340,59 @@ class BookPGPersistencePipeline:
                     bool(random.getrandbits(1))))
                 book_id = cursor.fetchone()[0]
 
-                cursor.execute('''
-                            INSERT INTO updates (
-                                book_id, rating, price, stock,
-                                tax, reviews, scraped_at
-                            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                        ''',
-                   (book_id,
-                    int(adapter.get('rating')) + randint(-1, 1),
-                    float(adapter.get('price')) + randint(-200, 200),
-                    int(adapter.get('stock')) + uniform(0, 5),
-                    float(adapter.get('tax')) + uniform(0, 2),
-                    int(adapter.get('reviews')) + randint(0, 5),
-                    adapter.get('scraped_at')))
+                # Rounded here rather than by the INTEGER columns so exports match the DB
+                update = {
+                    'rating': int(adapter.get('rating')) + randint(-1, 1),
+                    'price': round(float(adapter.get('price')) + randint(-200, 200)),
+                    'stock': round(int(adapter.get('stock')) + uniform(0, 5)),
+                    'tax': round(float(adapter.get('tax')) + uniform(0, 2)),
+                    'reviews': int(adapter.get('reviews')) + randint(0, 5),
+                    'scraped_at': adapter.get('scraped_at'),
+                }
+                self._save_update(cursor, book_id, update)
+                self._record_fetch(cursor, adapter)
                 self.connection.commit()
 
             spider.logger.info(f"✅ Persisted book: {adapter.get('title')}" + (" with embedding" if embedding else "without embedding"))
 
+            # Let the export pipelines see what was generated for this book,
+            # or the embedding kept in the database when none was generated
+            if self.crawler:
+                self.crawler.signals.send_catch_log(
+                    signal=book_persisted,
+                    book_id=book_id,
+                    upc=adapter.get('upc'),
+                    embedding=embedding if embedding is not None else stored_embedding,
+                    update=update,
+                    spider=spider
+                )
+
         except Exception as e:
             self.connection.rollback()
             spider.logger.error(f"❌ Book persistence error : {e}")
         finally:
             cursor.close()
 
+    def _record_fetch(self, cursor, adapter):
+        # A cached response says nothing about whether the page changed since
+        if not adapter.get('from_cache'):
+            record_fetch(cursor, adapter.get('link'), content_hash(adapter), adapter.get('scraped_at'))
+
+    def _save_update(self, cursor, book_id, update):
+        cursor.execute('''
+                INSERT INTO updates (
+                    book_id, rating, price, stock,
+                    tax, reviews, scraped_at
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ''',
+           (book_id,
+            update['rating'],
+            update['price'],
+            update['stock'],
+            update['tax'],
+            update['reviews'],
+            update['scraped_at']))
+
     def _save_genre(self, adapter, spider):
         # Vérifier la connexion avant toute opération
         self._ensure_connection(spider)
@@ -0,0 +1,177 @@
+from datetime import datetime, timezone
+from pathlib import Path
+
+from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+
+from data_scraper.items.author import Author
+from data_scraper.items.book import Book
+from data_scraper.items.quote import Quote
+from data_scraper.scheduler import frontier_worker_id
+from data_scraper.scope import in_scope
+from data_scraper.signals import book_persisted
+
+
+BOOK_INTEGER_FIELDS = ('rating', 'price', 'tax', 'stock', 'reviews')
+
+
+def build_schemas(embedding_dimensions):
+    import pyarrow as pa
+
+    timestamp = pa.timestamp('us', tz='UTC')
+    return {
+        'books': pa.schema([
+            ('book_id', pa.int32()),
+            ('upc', pa.string()),
+            ('type', pa.string()),
+            ('title', pa.string()),
+            ('thumbnail', pa.string()),
+            ('link', pa.string()),
+            ('description', pa.string()),
+            ('genre', pa.string()),
+            ('rating', pa.int8()),
+            ('price', pa.int32()),
+            ('tax', pa.int32()),
+            ('availability', pa.bool_()),
+            ('stock', pa.int32()),
+            ('reviews', pa.int32()),
+            ('scraped_at', timestamp),
+            ('description_embedding', pa.list_(pa.float32(), embedding_dimensions)),
+        ]),
+        'updates': pa.schema([
+            ('book_id', pa.int32()),
+            ('upc', pa.string()),
+            ('rating', pa.int8()),
+            ('price', pa.int32()),
+            ('tax', pa.int32()),
+            ('stock', pa.int32()),
+            ('reviews', pa.int32()),
+            ('scraped_at', timestamp),
+        ]),
+        'quotes': pa.schema([
+            ('content', pa.string()),
+            ('author', pa.string()),
+            ('tags', pa.list_(pa.string())),
+            ('scraped_at', timestamp),
+        ]),
+        'authors': pa.schema([
+            ('slug', pa.string()),
+            ('name', pa.string()),
+            ('link', pa.string()),
+        ]),
+    }
+
+
+class ParquetExportPipeline:
+    """Streams scraped items to Parquet files, one directory per run:
+    <PARQUET_EXPORT_DIR>/<spider>/run=<timestamp>/<table>.parquet
+
+    With the shared frontier, the workers of a crawl write side by side in
+    run=<FRONTIER_CRAWL_ID>/worker=<worker id>/ instead.
+
+    Rows are buffered and written as row groups of PARQUET_ROW_GROUP_SIZE rows.
+    Book ids, embeddings and updates come from BookPGPersistencePipeline through
+    the book_persisted signal, so this pipeline must run after it.
+    """
+
+    def __init__(self, export_dir, row_group_size, embedding_dimensions, frontier=None):
+        self.export_dir = Path(export_dir)
+        self.row_group_size = row_group_size
+        self.embedding_dimensions = embedding_dimensions
+        # (crawl id, worker id) when the crawl is split between workers
+        self.frontier = frontier
+        self.schemas = None
+        self.run_dir = None
+        self.buffers = {}
+        self.writers = {}
+        self.persisted_books = {}
+        # Authors come with each of their quotes, the authors table keeps one row per slug
+        self.author_slugs = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PARQUET_EXPORT_ENABLED'):
+            raise NotConfigured
+        pipeline = cls(
+            crawler.settings.get('PARQUET_EXPORT_DIR', 'exports'),
+            crawler.settings.getint('PARQUET_ROW_GROUP_SIZE', 10_000),
+            crawler.settings.getint('PARQUET_EMBEDDING_DIMENSIONS', 1536),
+            (crawler.settings.get('FRONTIER_CRAWL_ID'), frontier_worker_id(crawler.settings))
+            if crawler.settings.getbool('FRONTIER_ENABLED') else None,
+        )
+        crawler.signals.connect(pipeline.book_persisted, signal=book_persisted)
+        return pipeline
+
+    def open_spider(self, spider):
+        # pyarrow is only imported once the export actually runs
+        self.schemas = build_schemas(self.embedding_dimensions)
+        self.buffers = {table: [] for table in self.schemas}
+        if self.frontier:
+            # Workers start together, a timestamp would give them the same directory
+            crawl_id, worker_id = self.frontier
+            self.run_dir = self.export_dir / spider.name / f'run={crawl_id}' / f'worker={worker_id}'
+        else:
+            run = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+            self.run_dir = self.export_dir / spider.name / f'run={run}'
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        spider.logger.info(f"✅ Parquet export to {self.run_dir}")
+
+    def close_spider(self, spider):
+        for table in self.schemas:
+            self._flush(table)
+        for writer in self.writers.values():
+            writer.close()
+        spider.logger.info(f"✅ Parquet export closed: {', '.join(self.writers) or 'no rows'}")
+
+    def book_persisted(self, book_id, upc, embedding, update, spider):
+        if embedding is not None and len(embedding) != self.embedding_dimensions:
+            spider.logger.warning(f"⚠️ Unexpected embedding size {len(embedding)} for {upc}, not exported")
+            embedding = None
+        self.persisted_books[upc] = (book_id, embedding)
+        self._append('updates', {'book_id': book_id, 'upc': upc, **update})
+
+    def process_item(self, item, spider):
+        if isinstance(item, Book):
+            row = ItemAdapter(item).asdict()
+            if not in_scope(spider, row):
+                return item
+            # Loaders leave some numeric fields as scraped text
+            for field in BOOK_INTEGER_FIELDS:
+                if row.get(field) is not None:
+                    row[field] = int(row[field])
+            book_id, embedding = self.persisted_books.pop(row.get('upc'), (None, None))
+            row['book_id'] = book_id
+            row['description_embedding'] = embedding
+            self._append('books', row)
+        elif isinstance(item, Quote):
+            row = ItemAdapter(item).asdict()
+            row['tags'] = row['tags'].split(',') if row.get('tags') else []
+            self._append('quotes', row)
+        elif isinstance(item, Author):
+            row = ItemAdapter(item).asdict()
+            if row.get('slug') not in self.author_slugs:
+                self.author_slugs.add(row.get('slug'))
+                self._append('authors', row)
+        return item
+
+    def _append(self, table, row):
+        buffer = self.buffers[table]
+        buffer.append(row)
+        if len(buffer) >= self.row_group_size:
+            self._flush(table)
+
+    def _flush(self, table):
+        rows = self.buffers[table]
+        if not rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = self.schemas[table]
+        if table not in self.writers:
+            self.writers[table] = pq.ParquetWriter(self.run_dir / f'{table}.parquet', schema)
+        self.writers[table].write_table(
+            pa.Table.from_pylist(rows, schema=schema),
+            row_group_size=self.row_group_size
+        )
+        self.buffers[table] = []
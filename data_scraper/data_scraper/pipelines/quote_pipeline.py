@@ -1,41 +1,58 @@
-import psycopg2
+from time import perf_counter
 
 from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem
+from scrapy.utils.defer import deferred_from_coro
 
+from data_scraper.db import postgres_settings
 from data_scraper.items.quote import Quote
 from data_scraper.items.author import Author
+from data_scraper.signals import item_pipeline_processed
 
 
 class QuotePGPersistencePipeline:
     collection_name = "quotes"
 
-    def __init__(self, db_settings):
+    def __init__(self, db_settings, crawler=None):
         self.db_settings = db_settings
+        self.crawler = crawler
         self.connection = None
+        self.tables_created = False
+        # Set when the first connection fails, later items are dropped without retrying
+        self.connection_failed = False
 
     @classmethod
     def from_crawler(cls, crawler):
-        db_settings = {
-            'host': crawler.settings.get('POSTGRES_HOST'),
-            'port': crawler.settings.get('POSTGRES_PORT'),
-            'database': crawler.settings.get('POSTGRES_DB'),
-            'user': crawler.settings.get('POSTGRES_USER'),
-            'password': crawler.settings.get('POSTGRES_PASSWORD'),
-            'sslmode': crawler.settings.get('POSTGRES_SSL_MODE')
-        }
-        return cls(db_settings)
-
-    def open_spider(self, spider):
-        # Open connection to DB
+        db_settings = postgres_settings(crawler.settings)
+        return cls(db_settings, crawler)
+
+    def _ensure_connection(self, spider):
+        # Opened with the first item, runs that never reach this pipeline don't connect
+        if self.connection is not None and not self.connection.closed:
+            return
+        if self.connection_failed:
+            raise DropItem("Azure PostgreSQL unavailable")
+
+        import psycopg2
+
         try:
+            reconnecting = self.connection is not None
             self.connection = psycopg2.connect(**self.db_settings)
-            spider.logger.info("✅ Azure PostgreSQL connected")
+            if self.crawler:
+                self.crawler.stats.inc_value(f'pipeline/{self.collection_name}/db_connections')
+            spider.logger.info("🔄 Reconnected to Azure PostgreSQL" if reconnecting else "✅ Azure PostgreSQL connected")
 
             # Create table if needed
-            self._create_tables()
-
+            if not self.tables_created:
+                self._create_tables()
+                self.tables_created = True
         except Exception as e:
             spider.logger.error(f"❌ Azure PostgreSQL connection error : {e}")
+            if not self.tables_created:
+                # Nothing can be persisted this run, stop instead of failing every item
+                self.connection_failed = True
+                if self.crawler:
+                    deferred_from_coro(self.crawler.engine.close_spider_async(reason='postgres_unavailable'))
             raise
 
     def _create_tables(self):
@@ -64,23 +81,34 @@ class QuotePGPersistencePipeline:
 
     def close_spider(self, spider):
         # Close connection to DB
-        if self.connection:
+        if self.connection and not self.connection.closed:
             self.connection.close()
             spider.logger.info("✅ Disconnected from Azure PostgreSQL")
 
     def process_item(self, item, spider):
+        started = perf_counter()
         if isinstance(item, Quote):
             adapter = ItemAdapter(item).asdict()
             self._save_quote(adapter, spider)
-            return item
         elif isinstance(item, Author):
             adapter = ItemAdapter(item).asdict()
             self._save_author(adapter, spider)
-            return item
         else:
             return item
 
+        # Report latency for the backpressure extension
+        if self.crawler:
+            self.crawler.signals.send_catch_log(
+                signal=item_pipeline_processed,
+                pipeline=self.collection_name,
+                latency=perf_counter() - started,
+                spider=spider
+            )
+        return item
+
     def _save_quote(self, adapter, spider):
+        self._ensure_connection(spider)
+
         cursor = self.connection.cursor()
         # Save item in DB and replace values if it already exists
         try:
@@ -107,6 +135,8 @@ class QuotePGPersistencePipeline:
             cursor.close()
 
     def _save_author(self, adapter, spider):
+        self._ensure_connection(spider)
+
         cursor = self.connection.cursor()
         # Save item in DB and replace values if it already exists
         try:
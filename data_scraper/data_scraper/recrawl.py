@@ -0,0 +1,98 @@
+"""Change-frequency-aware recrawl of known books.
+
+Each fetch of a book page is recorded in book_crawl_stats with a hash of its
+content. Changes are modelled as a Poisson process: a book that changed c times
+over d days of observation changes at rate (c + prior_changes) / (d + prior_days)
+per day, and has changed since its last fetch, Δt days ago, with probability
+1 - exp(-rate * Δt). Books are recrawled by decreasing probability, so volatile
+books stay fresh while stable ones come back once enough time has passed.
+"""
+import hashlib
+import math
+
+
+# Fields of the page that make a book worth fetching again when they change
+CONTENT_FIELDS = (
+    'title', 'description', 'thumbnail', 'genre', 'type',
+    'rating', 'price', 'stock', 'availability', 'tax', 'reviews',
+)
+
+
+def content_hash(adapter):
+    content = '\x1f'.join(str(adapter.get(field)) for field in CONTENT_FIELDS)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def create_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS book_crawl_stats (
+            link VARCHAR(500) PRIMARY KEY,
+            content_hash CHAR(40) NOT NULL,
+            first_fetched_at TIMESTAMPTZ NOT NULL,
+            last_fetched_at TIMESTAMPTZ NOT NULL,
+            last_changed_at TIMESTAMPTZ,
+            fetch_count INTEGER NOT NULL DEFAULT 1,
+            change_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def record_fetch(cursor, link, digest, fetched_at):
+    """Counts a change when the content hash differs from the previous fetch"""
+    cursor.execute('''
+        INSERT INTO book_crawl_stats (link, content_hash, first_fetched_at, last_fetched_at)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (link) DO UPDATE SET
+            change_count = book_crawl_stats.change_count
+                + (book_crawl_stats.content_hash <> EXCLUDED.content_hash)::int,
+            last_changed_at = CASE
+                WHEN book_crawl_stats.content_hash <> EXCLUDED.content_hash THEN EXCLUDED.last_fetched_at
+                ELSE book_crawl_stats.last_changed_at
+            END,
+            content_hash = EXCLUDED.content_hash,
+            last_fetched_at = GREATEST(book_crawl_stats.last_fetched_at, EXCLUDED.last_fetched_at),
+            fetch_count = book_crawl_stats.fetch_count + 1
+    ''', (link, digest, fetched_at, fetched_at))
+
+
+def load_stats(connection):
+    """Returns (link, first_fetched_at, last_fetched_at, change_count) of every known book"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('book_crawl_stats') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return []
+        cursor.execute('SELECT link, first_fetched_at, last_fetched_at, change_count FROM book_crawl_stats')
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def change_probability(change_count, observed_days, days_since_fetch, prior_changes=1.0, prior_days=7.0):
+    # The prior keeps books seen once or twice from looking perfectly stable
+    rate = (change_count + prior_changes) / (observed_days + prior_days)
+    return 1 - math.exp(-rate * max(days_since_fetch, 0.0))
+
+
+def plan_recrawl(stats, now, max_requests=0, min_probability=0.0, prior_changes=1.0, prior_days=7.0):
+    """Returns [(link, probability)] of the known books to fetch, most likely changed first.
+
+    Books below min_probability are left for a later run, and at most
+    max_requests books are kept when it is set.
+    """
+    day = 86400
+    plan = []
+    for link, first_fetched_at, last_fetched_at, change_count in stats:
+        probability = change_probability(
+            change_count,
+            (last_fetched_at - first_fetched_at).total_seconds() / day,
+            (now - last_fetched_at).total_seconds() / day,
+            prior_changes,
+            prior_days,
+        )
+        if probability >= min_probability:
+            plan.append((link, probability))
+    plan.sort(key=lambda entry: entry[1], reverse=True)
+    if max_requests:
+        plan = plan[:max_requests]
+    return plan
@@ -0,0 +1,266 @@
+import logging
+import os
+import pickle
+import socket
+from collections import deque
+from time import monotonic
+
+from scrapy.core.scheduler import BaseScheduler
+from scrapy.utils.request import referer_str, request_from_dict
+
+from data_scraper.db import postgres_settings
+
+
+FRONTIER_META_KEY = "frontier_id"
+
+
+def frontier_worker_id(settings):
+    """Name of this process among the workers of a shared crawl"""
+    return settings.get('FRONTIER_WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class PostgresFrontierScheduler(BaseScheduler):
+    """Scheduler sharing its frontier and seen fingerprints through PostgreSQL.
+
+    Several identical processes using the same FRONTIER_CRAWL_ID split one crawl:
+    each one claims batches of pending requests with FOR UPDATE SKIP LOCKED and
+    holds them under a lease. A request is marked done once its response has
+    been fully processed, so the requests it yields are already in the frontier;
+    if the worker dies first, the lease expires and another worker claims it
+    again, up to FRONTIER_MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, crawler, db_settings, crawl_id, worker_id, batch_size, lease_secs, max_attempts, poll_interval):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.fingerprinter = crawler.request_fingerprinter
+        self.db_settings = db_settings
+        self.crawl_id = crawl_id
+        self.worker_id = worker_id
+        self.batch_size = batch_size
+        self.lease_secs = lease_secs
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.debug = crawler.settings.getbool('DUPEFILTER_DEBUG')
+        self.logdupes = True
+        self.logger = logging.getLogger(__name__)
+
+        self.connection = None
+        self.spider = None
+        self.buffer = deque()
+        self.in_progress = {}
+        self.next_poll = 0.0
+        self.pending_cache = (0.0, False)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        db_settings = postgres_settings(settings)
+        # Set once per launch and shared by its workers: a derived id (spider, date)
+        # would make any later run of the same id see the finished crawl as done
+        crawl_id = settings.get('FRONTIER_CRAWL_ID')
+        if not crawl_id:
+            raise ValueError("FRONTIER_CRAWL_ID is required when FRONTIER_ENABLED is set")
+        worker_id = frontier_worker_id(settings)
+        scheduler = cls(
+            crawler,
+            db_settings,
+            crawl_id,
+            worker_id,
+            settings.getint('FRONTIER_BATCH_SIZE', 16),
+            settings.getint('FRONTIER_LEASE_SECS', 300),
+            settings.getint('FRONTIER_MAX_ATTEMPTS', 5),
+            settings.getfloat('FRONTIER_POLL_INTERVAL', 1.0),
+        )
+        return scheduler
+
+    def open(self, spider):
+        import psycopg2
+
+        self.spider = spider
+        self.connection = psycopg2.connect(**self.db_settings)
+        self._create_tables()
+        # Every statement below stands on its own, the claim being a single UPDATE
+        self.connection.autocommit = True
+        spider.logger.info(f"✅ Shared frontier {self.crawl_id} opened by worker {self.worker_id}")
+
+    def _create_tables(self):
+        with self.connection:
+            cursor = self.connection.cursor()
+            # Workers start together, serialize the CREATE statements
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('crawl_frontier'))")
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS crawl_frontier (
+                    id BIGSERIAL PRIMARY KEY,
+                    crawl_id VARCHAR(200) NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    request BYTEA NOT NULL,
+                    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claimed_by VARCHAR(200),
+                    lease_expires_at TIMESTAMPTZ,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS crawl_frontier_claim_idx
+                ON crawl_frontier (crawl_id, status, priority DESC, id)
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS crawl_fingerprints (
+                    crawl_id VARCHAR(200) NOT NULL,
+                    fingerprint BYTEA NOT NULL,
+                    PRIMARY KEY (crawl_id, fingerprint)
+                )
+            ''')
+            cursor.close()
+
+    def close(self, reason):
+        if self.connection is None or self.connection.closed:
+            return
+        self._mark_done()
+        # Hand requests claimed but never sent back to the other workers
+        if self.buffer:
+            cursor = self.connection.cursor()
+            cursor.execute('''
+                UPDATE crawl_frontier
+                SET status = 'pending', claimed_by = NULL, lease_expires_at = NULL, attempts = attempts - 1
+                WHERE id = ANY(%s) AND claimed_by = %s
+            ''', ([frontier_id for frontier_id, _ in self.buffer], self.worker_id))
+            cursor.close()
+            self.buffer.clear()
+        self.connection.close()
+
+    def enqueue_request(self, request):
+        frontier_id = request.meta.get(FRONTIER_META_KEY)
+        cursor = self.connection.cursor()
+        try:
+            if frontier_id is not None:
+                # Retry or redirect of a request from the frontier: same row, back to pending
+                self.in_progress.pop(frontier_id, None)
+                cursor.execute('''
+                    UPDATE crawl_frontier
+                    SET request = %s, priority = %s, status = 'pending', claimed_by = NULL, lease_expires_at = NULL
+                    WHERE id = %s
+                ''', (self._serialize(request), request.priority, frontier_id))
+                self.stats.inc_value('scheduler/enqueued/postgres')
+                return True
+
+            # Start requests are sent by every worker, only the first one is kept
+            if not request.dont_filter or request.meta.get('is_start_request'):
+                cursor.execute('''
+                    INSERT INTO crawl_fingerprints (crawl_id, fingerprint) VALUES (%s, %s)
+                    ON CONFLICT DO NOTHING
+                ''', (self.crawl_id, self.fingerprinter.fingerprint(request)))
+                if cursor.rowcount == 0:
+                    self._log_duplicate(request)
+                    return False
+
+            cursor.execute('''
+                INSERT INTO crawl_frontier (crawl_id, priority, request) VALUES (%s, %s, %s)
+            ''', (self.crawl_id, request.priority, self._serialize(request)))
+            self.stats.inc_value('scheduler/enqueued/postgres')
+            self.pending_cache = (0.0, False)
+            self.next_poll = 0.0
+            return True
+        finally:
+            cursor.close()
+
+    def next_request(self):
+        self._mark_done()
+        if not self.buffer:
+            self._claim_batch()
+        if not self.buffer:
+            return None
+        frontier_id, payload = self.buffer.popleft()
+        request = request_from_dict(pickle.loads(payload), spider=self.spider)
+        request.meta[FRONTIER_META_KEY] = frontier_id
+        self.in_progress[frontier_id] = request
+        self.stats.inc_value('scheduler/dequeued/postgres')
+        return request
+
+    def has_pending_requests(self):
+        self._mark_done()
+        if self.buffer:
+            return True
+        # Requests claimed by other workers still count, they may add new ones
+        checked_at, pending = self.pending_cache
+        if monotonic() - checked_at >= self.poll_interval:
+            cursor = self.connection.cursor()
+            cursor.execute('''
+                SELECT EXISTS (
+                    SELECT 1 FROM crawl_frontier
+                    WHERE crawl_id = %s AND status IN ('pending', 'claimed') AND attempts < %s
+                )
+            ''', (self.crawl_id, self.max_attempts))
+            pending = cursor.fetchone()[0]
+            cursor.close()
+            self.pending_cache = (monotonic(), pending)
+        return pending
+
+    def _mark_done(self):
+        # The engine keeps a request in progress until the spider output of its
+        # response, or its errback, has been handled
+        if not self.in_progress:
+            return
+        slot = self.crawler.engine._slot
+        active = slot.inprogress if slot is not None else ()
+        done = [frontier_id for frontier_id, request in self.in_progress.items() if request not in active]
+        if not done:
+            return
+        cursor = self.connection.cursor()
+        cursor.execute('''
+            UPDATE crawl_frontier SET status = 'done', lease_expires_at = NULL
+            WHERE id = ANY(%s) AND status = 'claimed' AND claimed_by = %s
+        ''', (done, self.worker_id))
+        cursor.close()
+        for frontier_id in done:
+            del self.in_progress[frontier_id]
+
+    def _claim_batch(self):
+        # Don't query the database on every engine loop while the frontier is empty
+        if monotonic() < self.next_poll:
+            return
+        cursor = self.connection.cursor()
+        cursor.execute('''
+            UPDATE crawl_frontier
+            SET status = 'claimed', claimed_by = %s, attempts = attempts + 1,
+                lease_expires_at = NOW() + %s * INTERVAL '1 second'
+            WHERE id IN (
+                SELECT id FROM crawl_frontier
+                WHERE crawl_id = %s AND attempts < %s
+                    AND (status = 'pending' OR (status = 'claimed' AND lease_expires_at < NOW()))
+                ORDER BY priority DESC, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, request, priority
+        ''', (self.worker_id, self.lease_secs, self.crawl_id, self.max_attempts, self.batch_size))
+        rows = cursor.fetchall()
+        cursor.close()
+
+        if not rows:
+            self.next_poll = monotonic() + self.poll_interval
+            return
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        self.buffer.extend((frontier_id, bytes(payload)) for frontier_id, payload, _ in rows)
+        self.stats.inc_value('frontier/claimed', len(rows))
+
+    def _serialize(self, request):
+        return pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+
+    def _log_duplicate(self, request):
+        if self.debug:
+            msg = "Filtered duplicate request: %(request)s (referer: %(referer)s)"
+            args = {"request": request, "referer": referer_str(request)}
+            self.logger.debug(msg, args, extra={"spider": self.spider})
+        elif self.logdupes:
+            msg = (
+                "Filtered duplicate request: %(request)s"
+                " - no more duplicates will be shown"
+                " (see DUPEFILTER_DEBUG to show all duplicates)"
+            )
+            self.logger.debug(msg, {"request": request}, extra={"spider": self.spider})
+            self.logdupes = False
+
+        self.stats.inc_value("dupefilter/filtered")
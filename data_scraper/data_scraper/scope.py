@@ -0,0 +1,51 @@
+"""Scope of a targeted books crawl: scrapy crawl books -a genres=... -a upcs_file=... -a urls_file=..."""
+
+
+# Set on the requests of the books asked by UPC or URL, whose final URL may differ
+# from the requested one (redirects, other spelling of the same URL)
+SCOPE_META_KEY = "scope_requested"
+
+
+def read_lines(path):
+    """Non-empty lines of a file, lines starting with # are comments"""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def normalize_genre(name):
+    return ' '.join(name.split()).casefold()
+
+
+class CrawlScope:
+    """Genres, UPCs and URLs requested for a targeted crawl, a book is in scope if it matches any"""
+
+    def __init__(self, genres=(), upcs=(), links=()):
+        self.genres = {normalize_genre(genre) for genre in genres}
+        self.upcs = set(upcs)
+        self.links = set(links)
+
+    @classmethod
+    def from_spider_args(cls, genres=None, upcs_file=None, urls_file=None):
+        """None when no targeting argument is given, the whole catalogue is crawled"""
+        if not (genres or upcs_file or urls_file):
+            return None
+        return cls(
+            [genre for genre in genres.split(',') if genre.strip()] if genres else (),
+            read_lines(upcs_file) if upcs_file else (),
+            read_lines(urls_file) if urls_file else (),
+        )
+
+    def contains(self, adapter):
+        genre = adapter.get('genre')
+        return (
+            adapter.get('requested')
+            or (genre is not None and normalize_genre(genre) in self.genres)
+            or adapter.get('upc') in self.upcs
+            or adapter.get('link') in self.links
+        )
+
+
+def in_scope(spider, adapter):
+    """True when the spider crawls the whole catalogue or the book was requested"""
+    scope = getattr(spider, 'scope', None)
+    return scope is None or scope.contains(adapter)
@@ -37,21 +37,58 @@ DOWNLOAD_DELAY = 0.1
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "books_scraper.middlewares.BooksScraperSpiderMiddleware": 543,
-#}
+SPIDER_MIDDLEWARES = {
+    # Closest to the spider so that only callback code is timed
+    "data_scraper.middlewares.DataScraperSpiderMiddleware": 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "books_scraper.middlewares.BooksScraperDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    # Before the cache so that recrawls over the time budget are not even looked up
+    "data_scraper.middlewares.RecrawlBudgetMiddleware": 50,
+    # Closest to the downloader so that responses are stamped as soon as they arrive
+    "data_scraper.middlewares.DataScraperDownloaderMiddleware": 950,
+}
+
+# Per-callback profiling report written at spider close (disabled by default)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_OUTPUT_DIR = "profiling"
+PROFILING_TOP_N = 10
+# Share of responses parsed under cProfile, 0 to disable
+PROFILING_CPROFILE_SAMPLE_RATE = 0.0
+PROFILING_CPROFILE_LINES = 30
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "data_scraper.extensions.backpressure.PipelineBackpressure": 500,
+    "data_scraper.extensions.startup.StartupTiming": 500,
+    "data_scraper.extensions.book_neighbors.BookNeighbors": 900,
+}
+
+# Time to spider open / first request / first response / first item, and which
+# heavy modules each run ended up importing
+STARTUP_TIMING_ENABLED = True
+STARTUP_TRACKED_MODULES = ["psycopg2", "openai", "chompjs", "pyarrow", "numpy", "tiktoken"]
+
+# Top-k similar books written to book_neighbors after a finished books crawl
+# (enabled by the books spider)
+BOOK_NEIGHBORS_ENABLED = False
+BOOK_NEIGHBORS_K = 10
+BOOK_NEIGHBORS_BLOCK_SIZE = 1024
+
+# Throttle then pause request scheduling when the pipelines lag behind
+# (queue depth = responses waiting to be parsed + items in the pipelines)
+BACKPRESSURE_ENABLED = True
+BACKPRESSURE_INTERVAL = 1.0
+BACKPRESSURE_THROTTLE_DEPTH = 50
+BACKPRESSURE_PAUSE_DEPTH = 200
+BACKPRESSURE_RESUME_DEPTH = 20
+# Average seconds spent per item in the pipelines before throttling
+BACKPRESSURE_MAX_LATENCY = 1.0
+BACKPRESSURE_THROTTLE_DELAY = 1.0
+BACKPRESSURE_LATENCY_SMOOTHING = 0.2
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -80,12 +117,25 @@ HTTPCACHE_DIR = "httpcache"
 HTTPCACHE_IGNORE_HTTP_CODES = []
 HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
+# Seen requests are kept in a Bloom filter next to the HTTP cache, persisted until
+# the crawl finishes so that an interrupted run can be resumed
+DUPEFILTER_CLASS = "data_scraper.dupefilters.BloomDupeFilter"
+BLOOMFILTER_DIR = "httpcache/dupefilter"
+BLOOMFILTER_INITIAL_CAPACITY = 100_000
+BLOOMFILTER_ERROR_RATE = 0.001
+# Filters left by interrupted runs are forgotten once the cached responses have expired
+BLOOMFILTER_EXPIRATION_SECS = HTTPCACHE_EXPIRATION_SECS
+# Seconds between two writes of the filter state, so that killed runs can be resumed
+BLOOMFILTER_SAVE_INTERVAL = 30
+
 POSTGRES_HOST = os.getenv('AZURE_PG_HOST')
 POSTGRES_PORT = int(os.getenv('AZURE_PG_PORT', 5432))
 POSTGRES_DB = os.getenv('AZURE_PG_DB')
 POSTGRES_USER = os.getenv('AZURE_PG_USER')
 POSTGRES_PASSWORD = os.getenv('AZURE_PG_PASSWORD')
 POSTGRES_SSL_MODE = os.getenv('AZURE_PG_SSL_MODE')
+# Seconds before a connection to an unreachable database gives up (pipelines, spider, scheduler, extensions)
+POSTGRES_CONNECT_TIMEOUT = 10
 
 # Azure OpenAI settings for embeddings
 AZURE_OPENAI_API_KEY = os.getenv('AZURE_OPENAI_API_KEY')
@@ -93,10 +143,41 @@ AZURE_OPENAI_ENDPOINT = os.getenv('AZURE_OPENAI_ENDPOINT')
 AZURE_OPENAI_API_VERSION = os.getenv('AZURE_OPENAI_API_VERSION')
 AZURE_OPENAI_EMBEDDING_DEPLOYMENT = os.getenv('AZURE_OPENAI_EMBEDDING_DEPLOYMENT')
 
-ITEM_PIPELINES = {
-    'data_scraper.pipelines.book_pipeline.BookPGPersistencePipeline': 0,
-    'data_scraper.pipelines.quote_pipeline.QuotePGPersistencePipeline': 0,
-}
+# Descriptions are fitted to the embedding model input (tokenizer and limit of text-embedding-3-small)
+EMBEDDING_ENCODING = "cl100k_base"
+EMBEDDING_MAX_TOKENS = 8191
+# 1 truncates long descriptions, more splits them and averages the chunk embeddings
+EMBEDDING_MAX_CHUNKS = 1
+
+# Shared crawl frontier in PostgreSQL, lets several containers split one crawl
+FRONTIER_ENABLED = os.getenv('FRONTIER_ENABLED', 'false').lower() == 'true'
+if FRONTIER_ENABLED:
+    SCHEDULER = "data_scraper.scheduler.PostgresFrontierScheduler"
+# Required with the frontier: one new id per launch, shared by all its workers
+FRONTIER_CRAWL_ID = os.getenv('FRONTIER_CRAWL_ID')
+FRONTIER_BATCH_SIZE = 16
+FRONTIER_LEASE_SECS = 300
+FRONTIER_MAX_ATTEMPTS = 5
+FRONTIER_POLL_INTERVAL = 1.0
+
+# Known books are recrawled by estimated change probability (books spider)
+RECRAWL_ENABLED = os.getenv('RECRAWL_ENABLED', 'false').lower() == 'true'
+# Budgets of a run, 0 for no limit: number of known books, seconds of recrawling
+RECRAWL_MAX_REQUESTS = int(os.getenv('RECRAWL_MAX_REQUESTS', 0))
+RECRAWL_TIME_BUDGET = int(os.getenv('RECRAWL_TIME_BUDGET', 0))
+# Books less likely than this to have changed wait for a later run
+RECRAWL_MIN_CHANGE_PROBABILITY = 0.1
+# Rate assumed for books with little history: RECRAWL_PRIOR_CHANGES every RECRAWL_PRIOR_DAYS
+RECRAWL_PRIOR_CHANGES = 1.0
+RECRAWL_PRIOR_DAYS = 7.0
+
+# Item pipelines are enabled per spider, see custom_settings in each spider
+
+# Columnar export of books, updates, quotes and authors (one directory per run)
+PARQUET_EXPORT_ENABLED = os.getenv('PARQUET_EXPORT_ENABLED', 'false').lower() == 'true'
+PARQUET_EXPORT_DIR = os.getenv('PARQUET_EXPORT_DIR', 'exports')
+PARQUET_ROW_GROUP_SIZE = 10_000
+PARQUET_EMBEDDING_DIMENSIONS = 1536
 
 # Set settings whose default value is deprecated to a future-proof value
 FEED_EXPORT_ENCODING = "utf-8"
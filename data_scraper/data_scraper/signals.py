@@ -0,0 +1,12 @@
+# Project-specific signals, sent through crawler.signals like Scrapy's own.
+# See https://docs.scrapy.org/en/latest/topics/signals.html
+
+# Sent by the persistence pipelines once an item went through process_item.
+# Arguments: pipeline (str), latency (float, seconds), spider
+item_pipeline_processed = object()
+
+# Sent by BookPGPersistencePipeline once a book and its generated update are stored.
+# Arguments: book_id (int), upc (str), embedding (list of float, the new one or the
+# one stored for the book, None if it has none),
+# update (dict of the values written to the updates table), spider
+book_persisted = object()
@@ -8,11 +8,14 @@ from scrapy.loader import ItemLoader
 from scrapy.spiders import CrawlSpider, Rule
 from scrapy.linkextractors import LinkExtractor
 
+from data_scraper.db import postgres_settings
 from data_scraper.items.book import Book
 from data_scraper.itemloaders.book_loader import BookLoader
 
 from data_scraper.itemloaders.genre_loader import GenreLoader
 from data_scraper.items.genre import Genre
+from data_scraper.middlewares import RECRAWL_META_KEY
+from data_scraper.scope import SCOPE_META_KEY, CrawlScope, normalize_genre
 
 
 class BooksSpider(CrawlSpider):
@@ -21,15 +24,23 @@ class BooksSpider(CrawlSpider):
     start_urls = [
         "https://books.toscrape.com/catalogue/page-1.html"
     ]
+    custom_settings = {
+        "ITEM_PIPELINES": {
+            "data_scraper.pipelines.book_pipeline.BookPGPersistencePipeline": 0,
+            "data_scraper.pipelines.parquet_pipeline.ParquetExportPipeline": 100,
+        },
+        "BOOK_NEIGHBORS_ENABLED": True,
+    }
 
     rules = (
-        # Follow every index page
+        # Follow every index page, and category pages of targeted crawls
         Rule(
             LinkExtractor(
                 restrict_css="li.next > a",
-                allow=(r"catalogue/page-\d+\.html",),
+                allow=(r"catalogue/page-\d+\.html", r"catalogue/category/books/[^/]+/page-\d+\.html"),
             ),
-            follow=True
+            follow=True,
+            process_request="_filter_listing"
         ),
         # Handle every book encountered
         Rule(
@@ -38,10 +49,164 @@ class BooksSpider(CrawlSpider):
                 deny=(r"category/", r"catalogue/page-\d+\.html",)
             ),
             callback="_scrape_book",
-            follow=False
+            follow=False,
+            process_request="_filter_known_book"
         ),
     )
 
+    # Links of the books in the recrawl history, filled by start() when RECRAWL_ENABLED
+    recrawl_known = frozenset()
+    recrawl_selected = frozenset()
+
+    def __init__(self, genres=None, upcs_file=None, urls_file=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # -a genres=Travel,Poetry -a upcs_file=upcs.txt -a urls_file=urls.txt restrict the crawl
+        self.scope = CrawlScope.from_spider_args(genres, upcs_file, urls_file)
+        # URLs requested by a targeted crawl, which does its own deduplication
+        self.scope_seen = set()
+
+    async def start(self):
+        if self.scope is not None:
+            for request in self._targeted_requests():
+                yield request
+            return
+        async for item_or_request in super().start():
+            yield item_or_request
+        for request in self._recrawl_requests():
+            yield request
+
+    def _targeted_requests(self):
+        """Category listings of the requested genres, then the requested books directly"""
+        requests = []
+        if self.scope.genres:
+            # Category links are only listed in the sidebar of the catalogue
+            requests.append(self._scope_request(scrapy.Request(self.base_url, callback=self._parse_categories)))
+        links = sorted(self.scope.links | set(self._resolve_upcs()))
+        requests.extend(
+            self._scope_request(scrapy.Request(link, callback=self._scrape_book, meta={SCOPE_META_KEY: True}))
+            for link in links
+        )
+
+        stats = self.crawler.stats
+        stats.set_value("scope/genres", len(self.scope.genres))
+        stats.set_value("scope/books", len(links))
+        self.logger.info(
+            f"🎯 Targeted crawl: {len(self.scope.genres)} genres, {len(links)} books"
+        )
+        return [request for request in requests if request is not None]
+
+    def _scope_request(self, request):
+        # Targeted runs often follow a full crawl, whose fingerprints (persisted
+        # dupefilter, shared frontier) must not filter them: deduplicate within the run only
+        if request.url in self.scope_seen:
+            return None
+        self.scope_seen.add(request.url)
+        return request.replace(dont_filter=True)
+
+    def _resolve_upcs(self):
+        if not self.scope.upcs:
+            return []
+
+        import psycopg2
+
+        connection = None
+        try:
+            connection = psycopg2.connect(**postgres_settings(self.settings))
+            cursor = connection.cursor()
+            cursor.execute('SELECT upc, link FROM books WHERE upc = ANY(%s)', (sorted(self.scope.upcs),))
+            rows = cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            self.logger.error(f"❌ UPC resolution error : {e}")
+            return []
+        finally:
+            if connection:
+                connection.close()
+
+        missing = len(self.scope.upcs) - len(rows)
+        if missing:
+            self.logger.warning(f"⚠️ {missing} UPCs not found in books, they will not be crawled")
+        return [link for _, link in rows if link]
+
+    def _parse_categories(self, response: TextResponse):
+        categories = {}
+        for link in response.css("div.side_categories ul li ul li a"):
+            categories[normalize_genre(link.css("::text").get(default=""))] = response.urljoin(link.attrib["href"])
+
+        missing = self.scope.genres - categories.keys()
+        if missing:
+            self.logger.warning(f"⚠️ Unknown genres: {', '.join(sorted(missing))}")
+        for genre in sorted(self.scope.genres & categories.keys()):
+            # No callback: the listing goes through the rules like the catalogue pages
+            request = self._scope_request(scrapy.Request(categories[genre]))
+            if request is not None:
+                yield request
+
+    def _recrawl_requests(self):
+        """Known books to fetch this run, most likely changed first"""
+        if not self.settings.getbool("RECRAWL_ENABLED"):
+            return []
+
+        import psycopg2
+
+        from data_scraper.recrawl import load_stats, plan_recrawl
+
+        connection = None
+        try:
+            connection = psycopg2.connect(**postgres_settings(self.settings))
+            history = load_stats(connection)
+        except Exception as e:
+            self.logger.error(f"❌ Recrawl history unavailable, every book will be crawled : {e}")
+            return []
+        finally:
+            if connection:
+                connection.close()
+
+        plan = plan_recrawl(
+            history,
+            datetime.now(timezone.utc),
+            self.settings.getint("RECRAWL_MAX_REQUESTS"),
+            self.settings.getfloat("RECRAWL_MIN_CHANGE_PROBABILITY"),
+            self.settings.getfloat("RECRAWL_PRIOR_CHANGES", 1.0),
+            self.settings.getfloat("RECRAWL_PRIOR_DAYS", 7.0),
+        )
+        self.recrawl_known = frozenset(row[0] for row in history)
+        self.recrawl_selected = frozenset(link for link, _ in plan)
+
+        stats = self.crawler.stats
+        stats.set_value("recrawl/known", len(self.recrawl_known))
+        stats.set_value("recrawl/selected", len(plan))
+        stats.set_value("recrawl/expected_changes", round(sum(probability for _, probability in plan), 2))
+        self.logger.info(f"🔁 Recrawling {len(plan)} of {len(self.recrawl_known)} known books")
+
+        # Negative priorities: listing pages and new books go first
+        return [
+            scrapy.Request(
+                link,
+                callback=self._scrape_book,
+                priority=round(probability * 100) - 100,
+                meta={RECRAWL_META_KEY: probability},
+                # Also reachable from the listings, where _filter_known_book drops it
+                dont_filter=True,
+            )
+            for link, probability in plan
+        ]
+
+    def _filter_listing(self, request, response):
+        if self.scope is not None:
+            return self._scope_request(request)
+        return request
+
+    def _filter_known_book(self, request, response):
+        if self.scope is not None:
+            return self._scope_request(request)
+        # Known books are scheduled by start() when they are worth fetching again
+        if request.url not in self.recrawl_known:
+            return request
+        if request.url not in self.recrawl_selected:
+            self.crawler.stats.inc_value("recrawl/skipped")
+        return None
+
     def _scrape_book(self, response: TextResponse) -> Book:
         self.logger.info(f"📘 Scraping book {response.url}")
 
@@ -69,6 +234,8 @@ class BooksSpider(CrawlSpider):
         book_loader.add_css("tax", "th:contains('Tax') + *::text")
         book_loader.add_css("reviews", "th:contains('Number of reviews') + *::text")
         book_loader.add_value("scraped_at", datetime.now(timezone.utc))
+        book_loader.add_value("from_cache", "cached" in response.flags)
+        book_loader.add_value("requested", response.meta.get(SCOPE_META_KEY, False))
         yield book_loader.load_item()
 
     def _get_availability(self, response: TextResponse) -> bool:
@@ -1,7 +1,5 @@
 from datetime import datetime, timezone
 
-import chompjs
-
 from scrapy.http import TextResponse
 from scrapy.spiders import CrawlSpider, Rule
 from scrapy.linkextractors import LinkExtractor
@@ -19,6 +17,12 @@ class QuotesSpider(CrawlSpider):
     start_urls = [
         "https://quotes.toscrape.com/js/page/1"
     ]
+    custom_settings = {
+        "ITEM_PIPELINES": {
+            "data_scraper.pipelines.quote_pipeline.QuotePGPersistencePipeline": 0,
+            "data_scraper.pipelines.parquet_pipeline.ParquetExportPipeline": 100,
+        },
+    }
 
     rules = (
         # Follow every index page
@@ -35,6 +39,9 @@ class QuotesSpider(CrawlSpider):
     def _scrape_quotes(self, response: TextResponse):
         self.logger.info(f"Scraping from {response.url} ...")
 
+        # Imported here so that loading the spider (scrapy list, books runs) doesn't pay for it
+        import chompjs
+
         js_data = response.css("script::text").get()
 
         data_list = chompjs.parse_js_object(js_data)